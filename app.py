@@ -1,29 +1,76 @@
+import itertools
 import os
+import queue
 import threading
 import time
 import random
+import socket
 from typing import Dict, Any, Tuple, List
 
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from waitress import create_server
+import orjson
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 # ==============================
 # Configuration
 # ==============================
 
-GLOBAL_VERSION = 0
-GLOBAL_VERSION_LOCK = threading.Lock()
+# Monotonic write version; next() on itertools.count is a single C call, so it
+# is atomic under the GIL and needs no lock
+VERSION_COUNTER = itertools.count(1)
 
 ROLE = os.getenv("ROLE", "follower").lower()
 PORT = int(os.getenv("PORT", "8080"))
 
 FOLLOWER_URLS_ENV = os.getenv("FOLLOWER_URLS", "")
 FOLLOWER_URLS: List[str] = [u.strip() for u in FOLLOWER_URLS_ENV.split(",") if u.strip()]
+# follower base url -> its /replicate endpoint, built once instead of per request
+REPLICATE_URLS: Dict[str, str] = {u: u.rstrip("/") + "/replicate" for u in FOLLOWER_URLS}
 
 MIN_DELAY_MS = float(os.getenv("MIN_DELAY_MS", "0.0"))
 MAX_DELAY_MS = float(os.getenv("MAX_DELAY_MS", "1000.0"))
 
+# Worker threads executing requests; sockets themselves are multiplexed by
+# waitress' event loop, so idle connections do not hold a thread
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "64"))
+
+# Backpressure: beyond MAX_CONNECTIONS open connections waitress stops
+# accepting, and further clients wait in the kernel's listen backlog (waitress'
+# default of 1024) instead of piling up as queued tasks inside the process.
+# 100 is waitress' own default; it still covers the leader's replication pool
+# (64 per follower) and the benchmark clients.
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "100"))
+
+# Idle keep-alive connections are closed after this many seconds; long enough
+# that client pools survive the pauses between benchmark phases
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "60"))
+
+# Set on every accepted connection: no Nagle delay on small JSON replies and
+# kernel keepalive probes on idle client connections
+SERVER_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+# Upper bound on threads sending replication batches; threads are only started
+# when no idle one is available, so a quiet leader keeps few of them
+REPLICATION_WORKERS = int(os.getenv("REPLICATION_WORKERS", "50"))
+
+# Writes queued for the same follower within this window are sent as one batch
+REPLICATION_BATCH_WINDOW_MS = float(os.getenv("REPLICATION_BATCH_WINDOW_MS", "2.0"))
+REPLICATION_MAX_BATCH = int(os.getenv("REPLICATION_MAX_BATCH", "128"))
+
+# Per-request timeout for /replicate; a write gives up on its acks once the
+# slowest possible send (batch window + simulated delay + request) has passed
+REPLICATION_REQUEST_TIMEOUT = 5.0
+REPLICATION_ACK_TIMEOUT = (
+    REPLICATION_BATCH_WINDOW_MS / 1000.0 + MAX_DELAY_MS / 1000.0 + REPLICATION_REQUEST_TIMEOUT
+)
+
 DEFAULT_WRITE_QUORUM = int(os.getenv("WRITE_QUORUM", "1"))
 write_quorum_lock = threading.Lock()
 write_quorum = DEFAULT_WRITE_QUORUM
@@ -32,14 +79,56 @@ write_quorum = DEFAULT_WRITE_QUORUM
 # Data store and concurrency
 # ==============================
 
-# STORE: key -> {"value": str, "version": int}
-STORE: Dict[str, Dict[str, Any]] = {}
-STORE_LOCK = threading.Lock()
+# STORE is striped into NUM_SHARDS dicts, each guarded by its own lock, so
+# requests on unrelated keys do not serialize on a single global lock.
+# Each shard: key -> (value, version); a flat tuple per key instead of a nested dict
+NUM_SHARDS = 64  # power of two, shard index is hash(key) & (NUM_SHARDS - 1)
+STORE_SHARDS: List[Dict[str, Tuple[str, int]]] = [{} for _ in range(NUM_SHARDS)]
+STORE_LOCKS: List[threading.Lock] = [threading.Lock() for _ in range(NUM_SHARDS)]
 
 # Thread pool for replication tasks on the leader
-REPLICATION_EXECUTOR = ThreadPoolExecutor(max_workers=50)
+REPLICATION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=REPLICATION_WORKERS, thread_name_prefix="repl"
+)
+
+# Shared HTTP session so replication reuses keep-alive connections to followers
+# instead of opening a new TCP connection for every write
+REPLICATION_SESSION = requests.Session()
+REPLICATION_SESSION.mount(
+    "http://",
+    HTTPAdapter(pool_connections=max(len(FOLLOWER_URLS), 1), pool_maxsize=64, max_retries=0),
+)
+REPLICATION_SESSION.headers.update({
+    "Connection": "keep-alive",
+    "Content-Type": "application/json",
+})
+
+# Pending replication ops per follower: (key, value, version, ack future)
+ReplicationOp = Tuple[str, str, int, Future]
+REPLICATION_QUEUES: Dict[str, "queue.SimpleQueue[ReplicationOp]"] = {
+    url: queue.SimpleQueue() for url in FOLLOWER_URLS
+}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson encodes/decodes in C; used for request parsing and jsonify.
+    # Flask's own response() builds the reply; only the codec is swapped.
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = 0
+        if kwargs.get("sort_keys"):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 
 # ==============================
@@ -57,27 +146,50 @@ def set_write_quorum(new_q: int) -> None:
         write_quorum = new_q
 
 
-def set_local_value(key: str, value: str) -> int:
-    global GLOBAL_VERSION
+def shard_index(key: str) -> int:
+    return hash(key) & (NUM_SHARDS - 1)
+
 
-    with GLOBAL_VERSION_LOCK:
-        GLOBAL_VERSION += 1
-        version = GLOBAL_VERSION
+def get_shard(key: str) -> Tuple[threading.Lock, Dict[str, Tuple[str, int]]]:
+    idx = shard_index(key)
+    return STORE_LOCKS[idx], STORE_SHARDS[idx]
+
+
+def set_local_value(key: str, value: str) -> int:
+    version = next(VERSION_COUNTER)
 
-    with STORE_LOCK:
-        STORE[key] = {"value": value, "version": version}
+    lock, shard = get_shard(key)
+    with lock:
+        # concurrent writes to the same key may reach the shard out of order
+        record = shard.get(key)
+        if record is None or version > record[1]:
+            shard[key] = (value, version)
 
     print(f"[LEADER] COMMIT key={key} v={version} value={value}")
     return version
 
 
-def set_local_value_with_version(key: str, value: str, version: int) -> None:
-
-    with STORE_LOCK:
-        record = STORE.get(key)
-        old_ver = int(record["version"]) if record else 0
-        if version >= old_ver:
-            STORE[key] = {"value": value, "version": version}
+def set_local_values_with_version(entries: List[Tuple[str, str, int]]) -> None:
+    # group the batch by shard so each shard lock is taken once per batch
+    by_shard: Dict[int, List[Tuple[str, str, int]]] = {}
+    for entry in entries:
+        by_shard.setdefault(shard_index(entry[0]), []).append(entry)
+
+    outcomes = []
+    for idx, group in by_shard.items():
+        shard = STORE_SHARDS[idx]
+        # only the compare-and-assign is under the lock; logging happens after release
+        with STORE_LOCKS[idx]:
+            for key, value, version in group:
+                record = shard.get(key)
+                old_ver = record[1] if record else 0
+                applied = version >= old_ver
+                if applied:
+                    shard[key] = (value, version)
+                outcomes.append((key, value, version, old_ver, applied))
+
+    for key, value, version, old_ver, applied in outcomes:
+        if applied:
             print(f"[{ROLE.upper()}] APPLY key={key} old_v={old_ver} -> new_v={version} value={value}")
 
         else:
@@ -85,76 +197,175 @@ def set_local_value_with_version(key: str, value: str, version: int) -> None:
 
 
 def get_local_value(key: str) -> Dict[str, Any]:
-    with STORE_LOCK:
-        record = STORE.get(key)
+    lock, shard = get_shard(key)
+    with lock:
+        record = shard.get(key)
         if record is None:
             raise KeyError(key)
-        return {"key": key, "value": record["value"], "version": int(record["version"])}
+        value, version = record
+    return {"key": key, "value": value, "version": version}
+
+
+def get_local_values(keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    # same shard grouping as set_local_values_with_version; missing keys are left out
+    by_shard: Dict[int, List[str]] = {}
+    for key in keys:
+        by_shard.setdefault(shard_index(key), []).append(key)
+
+    records: Dict[str, Dict[str, Any]] = {}
+    for idx, group in by_shard.items():
+        shard = STORE_SHARDS[idx]
+        with STORE_LOCKS[idx]:
+            for key in group:
+                record = shard.get(key)
+                if record is not None:
+                    records[key] = {"value": record[0], "version": record[1]}
+    return records
 
 
-def replicate_to_single_follower(url: str, key: str, value: str, version: int) -> bool:
+def replicate_to_single_follower(url: str, batch: List[ReplicationOp]) -> bool:
+    versions = [op[2] for op in batch]
     try:
         delay_ms = random.uniform(MIN_DELAY_MS, MAX_DELAY_MS)
         time.sleep(delay_ms / 1000.0)
 
-        print(f"[LEADER] send key={key} v={version} to {url} delay={delay_ms:.1f}ms")
+        print(f"[LEADER] send {len(batch)} op(s) v={versions} to {url} delay={delay_ms:.1f}ms")
 
-        resp = requests.post(
-            f"{url}/replicate",
-            json={"key": key, "value": value, "version": version},
-            timeout=5.0,
+        resp = REPLICATION_SESSION.post(
+            REPLICATE_URLS[url],
+            data=orjson.dumps(
+                [{"key": key, "value": value, "version": version} for key, value, version, _ in batch]
+            ),
+            timeout=REPLICATION_REQUEST_TIMEOUT,
         )
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("status") == "ok":
-                print(f"[LEADER] follower={url} ack={ok} key={key} v={version}")
-            return data.get("status") == "ok"
-        return False
+        # followers ack with an empty 204; the status code alone is the ack
+        ok = resp.status_code in (200, 204)
     except Exception:
-        print(f"[LEADER] follower={url} ack={ok} key={key} v={version}")
+        ok = False
+
+    print(f"[LEADER] follower={url} ack={ok} v={versions}")
+    for _, _, _, ack in batch:
+        ack.set_result(ok)
+    return ok
+
+
+def replication_batcher(url: str) -> None:
+    # Collects ops queued for one follower during a short window and hands
+    # them to the executor as a single /replicate request
+    pending = REPLICATION_QUEUES[url]
+    window = REPLICATION_BATCH_WINDOW_MS / 1000.0
+
+    while True:
+        batch = [pending.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < REPLICATION_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
 
-        return False
+        REPLICATION_EXECUTOR.submit(replicate_to_single_follower, url, batch)
 
 
-def replicate_to_followers(key: str, value: str, version: int) -> Tuple[bool, int]:
-    if not FOLLOWER_URLS:
-        return True, 0
+_batchers_lock = threading.Lock()
+_batchers_started = False
+
+
+def start_replication_batchers() -> None:
+    # Started lazily by the first write rather than in __main__, so the leader
+    # also replicates when app is imported by another server or a test client
+    global _batchers_started
+    with _batchers_lock:
+        if _batchers_started:
+            return
+        for url in FOLLOWER_URLS:
+            threading.Thread(
+                target=replication_batcher, args=(url,), name=f"batcher-{url}", daemon=True
+            ).start()
+        _batchers_started = True
 
-    futures = []
+
+def enqueue_replication(key: str, value: str, version: int) -> List[Future]:
+    if not _batchers_started:
+        start_replication_batchers()
+
+    futures: List[Future] = []
     for url in FOLLOWER_URLS:
-        ftr = REPLICATION_EXECUTOR.submit(
-            replicate_to_single_follower, url, key, value, version
-        )
-        futures.append(ftr)
+        ack: Future = Future()
+        REPLICATION_QUEUES[url].put((key, value, version, ack))
+        futures.append(ack)
+    return futures
 
+
+def wait_for_quorum(futures: List[Future]) -> Tuple[bool, int]:
     required = get_write_quorum()
     ack_count = 0
+    remaining = len(futures)
     success = False
 
-    # Wait only until quorum is reached or all responses have arrived
-    for ftr in as_completed(futures):
-        try:
-            ok = ftr.result()
-        except Exception:
-            ok = False
-
-        if ok:
-            ack_count += 1
-            if ack_count >= required:
-                success = True
+    # Wait only until quorum is reached or can no longer be reached. The ops
+    # stay queued either way, so every follower still converges.
+    if remaining < required:
+        return success, ack_count
+
+    try:
+        for ftr in as_completed(futures, timeout=REPLICATION_ACK_TIMEOUT):
+            remaining -= 1
+            try:
+                ok = ftr.result()
+            except Exception:
+                ok = False
+
+            if ok:
+                ack_count += 1
+                if ack_count >= required:
+                    success = True
+                    break
+            elif ack_count + remaining < required:
                 break
+    except TimeoutError:
+        # acks still outstanding count as missing; the write fails instead of hanging
+        pass
 
     return success, ack_count
 
 
+def replicate_to_followers(key: str, value: str, version: int) -> Tuple[bool, int]:
+    if not FOLLOWER_URLS:
+        return True, 0
+
+    return wait_for_quorum(enqueue_replication(key, value, version))
+
+
 # ==============================
 # HTTP API
 # ==============================
 
+# Constant error bodies, encoded once at import instead of on every request
+ERR_WRITES_LEADER_ONLY = orjson.dumps({"error": "Writes are only accepted on the leader"})
+ERR_KEY_VALUE_REQUIRED = orjson.dumps({"error": "key and value are required"})
+ERR_OPS_REQUIRED = orjson.dumps({"error": "ops must be a non-empty list"})
+ERR_REPLICATE_FIELDS_REQUIRED = orjson.dumps({"error": "key, value and version are required"})
+ERR_KEY_NOT_FOUND = orjson.dumps({"error": "key not found"})
+ERR_KEYS_REQUIRED = orjson.dumps({"error": "keys must be a list of strings"})
+ERR_QUORUM_LEADER_ONLY = orjson.dumps({"error": "write quorum can only be configured on the leader"})
+ERR_QUORUM_REQUIRED = orjson.dumps({"error": "write_quorum is required"})
+ERR_QUORUM_TOO_SMALL = orjson.dumps({"error": "write_quorum must be >= 1"})
+
+
+def error_response(body: bytes, status: int) -> Any:
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
 @app.route("/health", methods=["GET"])
 def health() -> Any:
-    with STORE_LOCK:
-        keys = list(STORE.keys())
+    keys: List[str] = []
+    for lock, shard in zip(STORE_LOCKS, STORE_SHARDS):
+        with lock:
+            keys.extend(shard.keys())
     return jsonify({
         "status": "ok",
         "role": ROLE,
@@ -167,14 +378,14 @@ def health() -> Any:
 def handle_set() -> Any:
 
     if ROLE != "leader":
-        return jsonify({"error": "Writes are only accepted on the leader"}), 400
+        return error_response(ERR_WRITES_LEADER_ONLY, 400)
 
     data = request.get_json(force=True, silent=False)
     key = data.get("key")
     value = data.get("value")
 
     if key is None or value is None:
-        return jsonify({"error": "key and value are required"}), 400
+        return error_response(ERR_KEY_VALUE_REQUIRED, 400)
 
     version = set_local_value(key, value)
     success, ack_count = replicate_to_followers(key, value, version)
@@ -191,19 +402,86 @@ def handle_set() -> Any:
     }), (200 if success else 500)
 
 
-@app.route("/replicate", methods=["POST"])
-def handle_replicate() -> Any:
+@app.route("/set_batch", methods=["POST"])
+def handle_set_batch() -> Any:
+
+    if ROLE != "leader":
+        return error_response(ERR_WRITES_LEADER_ONLY, 400)
 
     data = request.get_json(force=True, silent=False)
-    key = data.get("key")
-    value = data.get("value")
-    version = data.get("version")
+    ops = data.get("ops") if isinstance(data, dict) else None
+
+    if not isinstance(ops, list) or not ops:
+        return error_response(ERR_OPS_REQUIRED, 400)
+
+    entries = []
+    for op in ops:
+        if not isinstance(op, dict):
+            return error_response(ERR_KEY_VALUE_REQUIRED, 400)
+        key = op.get("key")
+        value = op.get("value")
+
+        # keys index the shards and values are echoed back, so both must be strings
+        if not isinstance(key, str) or not isinstance(value, str):
+            return error_response(ERR_KEY_VALUE_REQUIRED, 400)
+        entries.append((key, value))
+
+    # Enqueue every op before waiting on any, so the batchers ship the whole
+    # request to each follower together
+    commits = []
+    for key, value in entries:
+        version = set_local_value(key, value)
+        futures = enqueue_replication(key, value, version) if FOLLOWER_URLS else []
+        commits.append((key, value, version, futures))
+
+    results = []
+    for key, value, version, futures in commits:
+        success, ack_count = wait_for_quorum(futures) if futures else (True, 0)
+        results.append({
+            "status": "committed" if success else "failed",
+            "key": key,
+            "value": value,
+            "version": version,
+            "acks": ack_count,
+        })
+
+    success = all(r["status"] == "committed" for r in results)
 
-    if key is None or value is None or version is None:
-        return jsonify({"error": "key, value and version are required"}), 400
+    return jsonify({
+        "status": "committed" if success else "failed",
+        "results": results,
+        "required_quorum": get_write_quorum(),
+    }), (200 if success else 500)
 
-    set_local_value_with_version(key, value, int(version))
-    return jsonify({"status": "ok"})
+
+@app.route("/replicate", methods=["POST"])
+def handle_replicate() -> Any:
+
+    data = request.get_json(force=True, silent=False)
+    # the leader sends a list of batched ops; a single op object is also accepted
+    ops = data if isinstance(data, list) else [data]
+
+    # the whole payload is validated before anything is applied
+    entries = []
+    for op in ops:
+        if not isinstance(op, dict):
+            return error_response(ERR_REPLICATE_FIELDS_REQUIRED, 400)
+        key = op.get("key")
+        value = op.get("value")
+        version = op.get("version")
+
+        # versions come from the leader's counter, so anything but an int is malformed
+        if (
+            not isinstance(key, str)
+            or value is None
+            or not isinstance(version, int)
+            or isinstance(version, bool)
+        ):
+            return error_response(ERR_REPLICATE_FIELDS_REQUIRED, 400)
+        entries.append((key, value, version))
+
+    set_local_values_with_version(entries)
+    return "", 204
 
 
 @app.route("/get/<key>", methods=["GET"])
@@ -213,23 +491,38 @@ def handle_get(key: str) -> Any:
         record = get_local_value(key)
         return jsonify(record)
     except KeyError:
-        return jsonify({"error": "key not found"}), 404
+        return error_response(ERR_KEY_NOT_FOUND, 404)
+
+
+@app.route("/get_batch", methods=["POST"])
+def handle_get_batch() -> Any:
+
+    data = request.get_json(force=True, silent=False)
+    keys = data.get("keys") if isinstance(data, dict) else None
+
+    # keys are hashed into shards and become the reply's object keys, so each
+    # must be a string
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return error_response(ERR_KEYS_REQUIRED, 400)
+
+    # keys the node does not hold are omitted from the reply
+    return jsonify(get_local_values(keys))
 
 
 @app.route("/config/write_quorum", methods=["POST"])
 def handle_set_write_quorum() -> Any:
 
     if ROLE != "leader":
-        return jsonify({"error": "write quorum can only be configured on the leader"}), 400
+        return error_response(ERR_QUORUM_LEADER_ONLY, 400)
 
     data = request.get_json(force=True, silent=False)
     q = data.get("write_quorum")
     if q is None:
-        return jsonify({"error": "write_quorum is required"}), 400
+        return error_response(ERR_QUORUM_REQUIRED, 400)
 
     q = int(q)
     if q < 1:
-        return jsonify({"error": "write_quorum must be >= 1"}), 400
+        return error_response(ERR_QUORUM_TOO_SMALL, 400)
 
     set_write_quorum(q)
     return jsonify({"status": "ok", "write_quorum": get_write_quorum()})
@@ -240,5 +533,19 @@ def handle_set_write_quorum() -> Any:
 # ==============================
 
 if __name__ == "__main__":
-    # threaded=True -> concurrent request handling on both leader and followers
-    app.run(host="0.0.0.0", port=PORT, threaded=True)
+    # waitress: one event loop accepts and polls every connection, a pool of
+    # SERVER_THREADS workers runs the handlers (HTTP/1.1 keep-alive supported)
+    server = create_server(
+        app,
+        host="0.0.0.0",
+        port=PORT,
+        threads=SERVER_THREADS,
+        connection_limit=MAX_CONNECTIONS,
+        channel_timeout=KEEPALIVE_TIMEOUT,
+        cleanup_interval=max(1, KEEPALIVE_TIMEOUT // 2),
+        asyncore_use_poll=True,
+    )
+    # not accepted as a keyword, but read from adj on every accept
+    server.adj.socket_options = SERVER_SOCKET_OPTIONS
+    print(f"[{ROLE.upper()}] serving on 0.0.0.0:{PORT} threads={SERVER_THREADS}")
+    server.run()
@@ -1,9 +1,10 @@
 import time
 import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 LEADER_URL = "http://localhost:8000"
 FOLLOWER_URLS = [
@@ -14,29 +15,81 @@ FOLLOWER_URLS = [
     "http://localhost:8005",
 ]
 
+# One pooled session shared by every test and worker thread, so calls reuse
+# keep-alive connections instead of opening a new one per request
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+
 
 def set_write_quorum(q: int) -> None:
     print(f"\n[config] Setting write quorum to {q}")
-    resp = requests.post(
+    resp = SESSION.post(
         f"{LEADER_URL}/config/write_quorum",
         json={"write_quorum": q},
         timeout=5.0,
     )
-    resp.raise_for_status()
+    if resp.status_code != 200:
+        raise RuntimeError(f"Setting write_quorum={q} failed ({resp.status_code}): {resp.text}")
 
 
 def get_record(base_url: str, key: str) -> Dict:
-    resp = requests.get(f"{base_url}/get/{key}", timeout=5.0)
+    resp = SESSION.get(f"{base_url}/get/{key}", timeout=5.0)
     if resp.status_code != 200:
         raise KeyError(f"{base_url} missing key {key}")
     data = resp.json()
     return {"value": data["value"], "version": int(data["version"])}
 
 
-def check_key_consistency(key: str) -> None:
-    leader_rec = get_record(LEADER_URL, key)
+def read_records(urls: List[str], keys: List[str]) -> Dict[str, Dict[str, Dict]]:
+    # Fetch every (url, key) record concurrently and group them per node:
+    # {url: {key: record}}. A missing key raises KeyError like get_record.
+    with ThreadPoolExecutor(max_workers=min(32, len(urls) * len(keys))) as executor:
+        futures = {
+            url: [executor.submit(get_record, url, key) for key in keys] for url in urls
+        }
+        return {
+            url: {key: fut.result() for key, fut in zip(keys, futs)}
+            for url, futs in futures.items()
+        }
+
+
+def wait_until_replicated(
+    key: str,
+    expected_version: int,
+    urls: List[str] = FOLLOWER_URLS,
+    timeout: float = 5.0,
+    initial: float = 0.02,
+) -> None:
+    # Poll with exponential backoff until every url holds at least
+    # expected_version of key, instead of sleeping a fixed amount. On timeout
+    # it just returns and lets the caller's assertions report the lag.
+    deadline = time.perf_counter() + timeout
+    delay = initial
+    lagging = list(urls)
+    while True:
+        still_lagging = []
+        for url in lagging:
+            try:
+                if get_record(url, key)["version"] >= expected_version:
+                    continue
+            except KeyError:
+                pass
+            still_lagging.append(url)
+        lagging = still_lagging
+
+        if not lagging or time.perf_counter() >= deadline:
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def check_key_consistency(key: str, expected: Optional[Dict] = None) -> None:
+    # expected is the record the leader already returned from /set; only read
+    # it back from the leader when the caller doesn't have it
+    leader_rec = expected if expected is not None else get_record(LEADER_URL, key)
+    follower_recs = read_records(FOLLOWER_URLS, [key])
     for url in FOLLOWER_URLS:
-        follower_rec = get_record(url, key)
+        follower_rec = follower_recs[url][key]
         assert follower_rec == leader_rec, (
             f"[{key}] follower {url} out of sync: {follower_rec} vs {leader_rec}"
         )
@@ -49,7 +102,7 @@ def test_single_write_replication() -> None:
     key = "test_single"
     value = "hello_world"
 
-    resp = requests.post(
+    resp = SESSION.post(
         f"{LEADER_URL}/set",
         json={"key": key, "value": value},
         timeout=10.0,
@@ -61,11 +114,11 @@ def test_single_write_replication() -> None:
     assert data["status"] == "committed"
     assert data["acks"] >= 3, f"Expected at least 3 acks, got {data['acks']}"
 
-    # allow followers to catch up
-    time.sleep(3.0)
+    # wait for followers to catch up
+    wait_until_replicated(key, int(data["version"]))
 
-    # check value + version everywhere
-    check_key_consistency(key)
+    # check value + version everywhere, against what the leader committed
+    check_key_consistency(key, {"value": data["value"], "version": int(data["version"])})
     print(" Test 1 passed: single write replicated consistently to all followers.")
 
 
@@ -77,14 +130,15 @@ def test_concurrent_writes_consistency() -> None:
     values = [f"val_{i}" for i in range(5)]
 
     def write_key(k: str, v: str):
-        r = requests.post(
+        r = SESSION.post(
             f"{LEADER_URL}/set",
             json={"key": k, "value": v},
             timeout=10.0,
         )
         return r.json()
 
-    versions: Dict[str, int] = {}
+    # key -> record the leader committed, taken straight from the /set reply
+    committed: Dict[str, Dict] = {}
 
     with ThreadPoolExecutor(max_workers=len(keys)) as executor:
         futures = []
@@ -96,20 +150,28 @@ def test_concurrent_writes_consistency() -> None:
             print("Write result:", data)
             assert data["status"] == "committed"
             k = data["key"]
-            versions[k] = int(data["version"])
-
-    # allow replication to catch up
-    time.sleep(3.0)
-
-    # check each key on leader + followers
-    for k, expected_version in versions.items():
-        leader_rec = get_record(LEADER_URL, k)
+            committed[k] = {"value": data["value"], "version": int(data["version"])}
+
+    # wait for replication to catch up
+    for k, leader_rec in committed.items():
+        wait_until_replicated(k, leader_rec["version"])
+
+    # read each key on the leader and the followers in one concurrent pass;
+    # the leader must have stored what it committed, and the followers must
+    # match the leader
+    records = read_records([LEADER_URL] + FOLLOWER_URLS, list(committed))
+    for k, committed_rec in committed.items():
+        leader_rec = records[LEADER_URL][k]
         expected_value = f"val_{k.split('_')[-1]}"
-        assert leader_rec["value"] == expected_value
-        assert leader_rec["version"] == expected_version
+        assert leader_rec["value"] == expected_value, (
+            f"[{k}] leader stored {leader_rec['value']}, expected {expected_value}"
+        )
+        assert leader_rec == committed_rec, (
+            f"[{k}] leader stored {leader_rec}, but /set reported {committed_rec}"
+        )
 
         for url in FOLLOWER_URLS:
-            follower_rec = get_record(url, k)
+            follower_rec = records[url][k]
             assert follower_rec == leader_rec, (
                 f"[{k}] follower {url} out of sync: {follower_rec} vs {leader_rec}"
             )
@@ -117,13 +179,93 @@ def test_concurrent_writes_consistency() -> None:
     print(" Test 2 passed: concurrent writes replicated consistently to all followers.")
 
 
+def test_set_batch_replication() -> None:
+    print("\n=== Test 3: batched writes via /set_batch with quorum=3 ===")
+    set_write_quorum(3)
+
+    ops = [{"key": f"batch_key_{i}", "value": f"batch_val_{i}"} for i in range(5)]
+
+    resp = SESSION.post(f"{LEADER_URL}/set_batch", json={"ops": ops}, timeout=10.0)
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    print("Leader /set_batch response:", data)
+
+    assert data["status"] == "committed"
+    results = data["results"]
+    assert len(results) == len(ops), f"Expected {len(ops)} results, got {len(results)}"
+
+    # one result per op, in request order, each with its own fresh version
+    committed: Dict[str, Dict] = {}
+    for op, result in zip(ops, results):
+        assert result["status"] == "committed", result
+        assert result["key"] == op["key"] and result["value"] == op["value"], result
+        assert result["acks"] >= 3, f"Expected at least 3 acks, got {result['acks']}"
+        committed[result["key"]] = {"value": result["value"], "version": int(result["version"])}
+
+    versions = [rec["version"] for rec in committed.values()]
+    assert len(set(versions)) == len(versions), f"Batch ops share versions: {versions}"
+
+    for k, rec in committed.items():
+        wait_until_replicated(k, rec["version"])
+
+    # the leader and every follower must hold exactly what the batch committed
+    records = read_records([LEADER_URL] + FOLLOWER_URLS, list(committed))
+    for url, recs in records.items():
+        for k, rec in committed.items():
+            assert recs[k] == rec, f"[{k}] {url} out of sync: {recs[k]} vs {rec}"
+
+    # malformed ops are rejected as a whole, with nothing written
+    for bad in ({"ops": [1]}, {"ops": [{"key": ["x"], "value": "v"}]}):
+        resp = SESSION.post(f"{LEADER_URL}/set_batch", json=bad, timeout=10.0)
+        assert resp.status_code == 400, f"{bad} -> {resp.status_code} {resp.text}"
+
+    print(" Test 3 passed: batched writes committed and replicated to all followers.")
+
+
+def test_get_batch_reads() -> None:
+    print("\n=== Test 4: batched reads via /get_batch ===")
+    set_write_quorum(5)
+
+    keys = [f"get_batch_key_{i}" for i in range(3)]
+    committed: Dict[str, Dict] = {}
+    for i, k in enumerate(keys):
+        resp = SESSION.post(
+            f"{LEADER_URL}/set",
+            json={"key": k, "value": f"get_batch_val_{i}"},
+            timeout=10.0,
+        )
+        assert resp.status_code == 200, resp.text
+        data = resp.json()
+        committed[k] = {"value": data["value"], "version": int(data["version"])}
+
+    # with quorum=5 every follower acked, so each node must answer for all keys;
+    # keys a node does not hold are left out of its reply
+    requested = keys + ["get_batch_missing"]
+    for url in [LEADER_URL] + FOLLOWER_URLS:
+        resp = SESSION.post(f"{url}/get_batch", json={"keys": requested}, timeout=5.0)
+        assert resp.status_code == 200, resp.text
+        batch = {k: {"value": r["value"], "version": int(r["version"])} for k, r in resp.json().items()}
+        assert batch == committed, f"{url} /get_batch returned {batch}, expected {committed}"
+
+        # and agree with the per-key endpoint
+        for k in keys:
+            assert get_record(url, k) == batch[k], f"[{k}] {url} /get disagrees with /get_batch"
+
+    # anything but {"keys": [str, ...]} is rejected
+    for bad in ([], {"keys": "x"}, {"keys": [["a"]]}, {"keys": [1]}):
+        resp = SESSION.post(f"{LEADER_URL}/get_batch", json=bad, timeout=5.0)
+        assert resp.status_code == 400, f"{bad} -> {resp.status_code} {resp.text}"
+
+    print(" Test 4 passed: /get_batch matches /get on every node.")
+
+
 def main() -> None:
     # quick health check
     print("Checking cluster health...")
-    lh = requests.get(f"{LEADER_URL}/health", timeout=5.0).json()
+    lh = SESSION.get(f"{LEADER_URL}/health", timeout=5.0).json()
     print("Leader:", lh)
     for f in FOLLOWER_URLS:
-        fh = requests.get(f"{f}/health", timeout=5.0).json()
+        fh = SESSION.get(f"{f}/health", timeout=5.0).json()
         print(f"{f}:", fh)
 
     race_demo_same_key()
@@ -140,7 +282,7 @@ def race_demo_same_key():
 
     def write_once(i: int):
         value = f"race_val_{i}"
-        r = requests.post(
+        r = SESSION.post(
             f"{LEADER_URL}/set",
             json={"key": key, "value": value},
             timeout=10.0,
@@ -153,17 +295,17 @@ def race_demo_same_key():
         for fut in as_completed(futures):
             fut.result()
 
-    # Give replication time to finish
-    time.sleep(5.0)
-
     # Final state on leader
     leader_rec = get_record(LEADER_URL, key)
     print("[CLIENT] FINAL leader:", leader_rec)
 
+    # Wait for replication of the winning version to finish
+    wait_until_replicated(key, leader_rec["version"])
+
     # Final state on followers
+    follower_recs = read_records(FOLLOWER_URLS, [key])
     for url in FOLLOWER_URLS:
-        follower_rec = get_record(url, key)
-        print(f"[CLIENT] FINAL {url}:", follower_rec)
+        print(f"[CLIENT] FINAL {url}:", follower_recs[url][key])
 
 
 if __name__ == "__main__":
@@ -1,10 +1,12 @@
+import os
 import time
-import statistics
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+import numpy as np
+import orjson
 import requests
-import matplotlib.pyplot as plt
+from requests.adapters import HTTPAdapter
 
 LEADER_URL = "http://localhost:8000"
 FOLLOWER_URLS = [
@@ -16,103 +18,275 @@ FOLLOWER_URLS = [
 ]
 
 TOTAL_WRITES = 100
-CONCURRENCY = 5
+# Writers in flight; raise it (up to the leader's SERVER_THREADS) to load the cluster harder
+CONCURRENCY = int(os.getenv("CONCURRENCY", "5"))
 KEYS = [f"key_{i}" for i in range(10)]  # 10 keys: key_0..key_9
+CHECK_WORKERS = 32  # concurrent reads during a consistency check
+# Writes per request; above 1 the writes go through the leader's /set_batch
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1"))
+
+SET_URL = f"{LEADER_URL}/set"
+SET_BATCH_URL = f"{LEADER_URL}/set_batch"
+JSON_HEADERS = {"Content-Type": "application/json"}
+COMMITTED = {"status": "committed"}  # shared result for writes the leader answered 200
+
+# One pooled session for every request the script makes (writes, config,
+# health and consistency reads), so each of the 6 nodes is connected to once
+# and the keep-alive connections survive across all quorum experiments
+SESSION = requests.Session()
+SESSION.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=max(2 * CONCURRENCY, CHECK_WORKERS),
+        max_retries=0,
+    ),
+)
+SESSION.headers.update(JSON_HEADERS)
+
+# Long-lived pool for the read fan-out of every consistency check, so the
+# checks reuse warm threads (and their pooled connections) between quorum runs
+CHECK_EXECUTOR = ThreadPoolExecutor(max_workers=CHECK_WORKERS)
+
+
+def wait_for_cluster(max_wait: float = 30.0) -> None:
+    # Poll each node's /health with exponential backoff (50 ms up to 1 s), so
+    # the run starts as soon as the containers answer
+    deadline = time.perf_counter() + max_wait
+    for url in [LEADER_URL] + FOLLOWER_URLS:
+        delay = 0.05
+        while True:
+            try:
+                if SESSION.get(f"{url}/health", timeout=2.0).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if time.perf_counter() >= deadline:
+                raise RuntimeError(f"{url} is not healthy after {max_wait:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 1.5, 1.0)
 
 
 def set_write_quorum(q: int) -> None:
-    resp = requests.post(
+    resp = SESSION.post(
         f"{LEADER_URL}/config/write_quorum",
         json={"write_quorum": q},
         timeout=5.0,
     )
-    resp.raise_for_status()
+    if resp.status_code != 200:
+        raise RuntimeError(f"Setting write_quorum={q} failed ({resp.status_code}): {resp.text}")
+    # the leader applies the new quorum before replying, so the reply is the
+    # confirmation; no settle time is needed afterwards
+    applied = orjson.loads(resp.content).get("write_quorum")
+    if applied != q:
+        raise RuntimeError(f"Leader reports write_quorum={applied}, expected {q}")
 
 
-def do_write(session: requests.Session, key: str, value: str) -> Tuple[float, Dict]:
+def do_write(session: requests.Session, body: bytes) -> Tuple[int, Dict]:
 
-    start = time.time()
+    start = time.perf_counter_ns()
     resp = session.post(
-        f"{LEADER_URL}/set",
-        json={"key": key, "value": value},
+        SET_URL,
+        data=body,
         timeout=10.0,
     )
-    latency_ms = (time.time() - start) * 1000.0
-    data = resp.json()
-    return latency_ms, data
+    latency_ns = time.perf_counter_ns() - start
+    # The leader answers 200 only when the write reached its quorum, so the
+    # body is only decoded for failures, where it carries the details
+    if resp.status_code == 200:
+        return latency_ns, COMMITTED
+    return latency_ns, orjson.loads(resp.content)
+
 
+def do_write_batch(session: requests.Session, body: bytes, num_ops: int) -> Tuple[int, Dict]:
 
-def run_experiment_for_quorum(q: int) -> float:
+    start = time.perf_counter_ns()
+    resp = session.post(
+        SET_BATCH_URL,
+        data=body,
+        timeout=10.0,
+    )
+    latency_ns = time.perf_counter_ns() - start
+    # 200 means every op in the batch committed
+    if resp.status_code == 200:
+        return latency_ns, {"status": "committed", "results": [COMMITTED] * num_ops}
+    return latency_ns, orjson.loads(resp.content)
+
+
+def run_experiment_for_quorum(q: int) -> Tuple[float, Set[str]]:
 
     print(f"\n=== Running experiment for write quorum = {q} ===")
     set_write_quorum(q)
-    time.sleep(1.0)  # small pause to let config settle
 
-    latencies: List[float] = []
+    # One slot per write in integer nanoseconds (monotonic perf_counter_ns),
+    # filled by write id; -1 marks writes that errored.
+    # In batch mode every write in a batch is charged the batch's latency,
+    # since that is how long each of them waited to commit.
+    latencies_ns = np.full(TOTAL_WRITES, -1, dtype=np.int64)
     successes = 0
-
-    with requests.Session() as session:
-        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
-            futures = []
-            for i in range(TOTAL_WRITES):
-                key = KEYS[i % len(KEYS)]
-                value = f"value_q{q}_{i}"
-                futures.append(executor.submit(do_write, session, key, value))
-
-            for fut in as_completed(futures):
+    failures: List[Dict] = []
+    errors: List[str] = []
+
+    # Encode every request body up front so the submit loop and the workers
+    # only move prebuilt bytes; each job carries the ids of the writes it holds
+    writes = [(KEYS[i % len(KEYS)], f"value_q{q}_{i}") for i in range(TOTAL_WRITES)]
+    jobs: List[Tuple[range, bytes]] = []
+    for first in range(0, TOTAL_WRITES, BATCH_SIZE):
+        write_ids = range(first, min(first + BATCH_SIZE, TOTAL_WRITES))
+        if BATCH_SIZE > 1:
+            ops = [{"key": writes[i][0], "value": writes[i][1]} for i in write_ids]
+            body = orjson.dumps({"ops": ops})
+        else:
+            key, value = writes[first]
+            body = orjson.dumps({"key": key, "value": value})
+        jobs.append((write_ids, body))
+
+    # Keep at most 2 * CONCURRENCY requests submitted at a time, topping the
+    # window up as they finish, instead of queueing all TOTAL_WRITES at once
+    max_pending = 2 * CONCURRENCY
+    pending: Dict[Future, range] = {}  # future -> ids of the writes it carries
+    next_job = 0
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        while next_job < len(jobs) or pending:
+            while next_job < len(jobs) and len(pending) < max_pending:
+                write_ids, body = jobs[next_job]
+                if BATCH_SIZE > 1:
+                    fut = executor.submit(do_write_batch, SESSION, body, len(write_ids))
+                else:
+                    fut = executor.submit(do_write, SESSION, body)
+                pending[fut] = write_ids
+                next_job += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                write_ids = pending.pop(fut)
                 try:
-                    latency_ms, data = fut.result()
-                    latencies.append(latency_ms)
-                    if data.get("status") == "committed":
-                        successes += 1
-                    else:
-                        print("Write failed:", data)
+                    latency_ns, data = fut.result()
+                    latencies_ns[write_ids.start:write_ids.stop] = latency_ns
+                    # a batch reply lists one result per write
+                    for result in data.get("results", [data]):
+                        if result.get("status") == "committed":
+                            successes += 1
+                        else:
+                            failures.append(result)
                 except Exception as e:
-                    print("Error during write:", e)
-
-    if not latencies:
+                    errors.append(repr(e))
+
+    # reported only once the run is over, so printing never competes with the
+    # writes still in flight
+    for result in failures:
+        print("Write failed:", result)
+    for error in errors:
+        print("Error during write:", error)
+    if failures or errors:
+        print(f"Quorum {q}: {len(failures)} failed writes, {len(errors)} errors")
+
+    collected = latencies_ns[latencies_ns >= 0]
+    if collected.size == 0:
         raise RuntimeError("No write latencies collected")
 
-    avg_latency = statistics.mean(latencies)
+    # convert to milliseconds only once, for reporting
+    avg_latency = float(collected.mean()) / 1e6
+    p50, p95, p99 = np.percentile(collected, [50, 95, 99]) / 1e6
     print(
-        f"Quorum {q}: average latency = {avg_latency:.2f} ms, "
+        f"Quorum {q}: average latency = {avg_latency:.2f} ms "
+        f"(p50 = {p50:.2f}, p95 = {p95:.2f}, p99 = {p99:.2f} ms), "
         f"successes = {successes}/{TOTAL_WRITES}"
     )
-    return avg_latency
+    # every submitted write may have changed its key on the leader, even the
+    # ones that failed to reach quorum or errored on the client side
+    dirty = {key for key, _ in writes}
+    return avg_latency, dirty
 
 
-def get_record(base_url: str, key: str) -> Dict:
-    resp = requests.get(f"{base_url}/get/{key}", timeout=5.0)
-    if resp.status_code != 200:
-        raise KeyError(f"{base_url} missing key {key}")
-    data = resp.json()
-    return {"value": data["value"], "version": int(data["version"])}
+Record = Tuple[str, int]  # (value, version)
 
+# Last leader record seen per key; only keys written since are re-read
+_leader_cache: Dict[str, Record] = {}
 
-def check_data_consistency(label: str = "") -> None:
+
+def get_records(base_url: str, keys: List[str]) -> Dict[str, Record]:
+    # One /get_batch round trip per node; keys the node does not hold are absent.
+    # Records are kept as tuples so replicas compare slot by slot.
+    resp = SESSION.post(f"{base_url}/get_batch", data=orjson.dumps({"keys": keys}), timeout=5.0)
+    resp.raise_for_status()
+    return {
+        key: (rec["value"], rec["version"])
+        for key, rec in orjson.loads(resp.content).items()
+    }
+
+
+def fetch_records(nodes: List[str]) -> Dict[str, Dict[str, Record]]:
+    # The per-node reads are independent, so fetch them concurrently
+    return dict(zip(nodes, CHECK_EXECUTOR.map(lambda node: get_records(node, KEYS), nodes)))
+
+
+def check_data_consistency(
+    label: str = "", timeout: float = 5.0, dirty: Optional[Iterable[str]] = None
+) -> None:
 
     if label:
         print(f"\n=== Consistency check {label} ===")
     else:
         print("\n=== Consistency check ===")
 
-    # Give some time for lagging replication calls to finish
-    time.sleep(5.0)
+    # Sample the leader once, then poll the followers with backoff until each
+    # holds at least the leader's version of every key (or the timeout passes)
+    # instead of always sleeping for the worst-case replication lag.
+    # The leader sample only re-reads keys written since the last check (all
+    # keys when dirty is not given) plus any it has never seen.
+    stale = set(KEYS) if dirty is None else set(dirty)
+    stale.update(key for key in KEYS if key not in _leader_cache)
+    if stale:
+        fresh = get_records(LEADER_URL, [key for key in KEYS if key in stale])
+        for key in stale:
+            _leader_cache.pop(key, None)
+        _leader_cache.update(fresh)
+    leader_records = {key: _leader_cache[key] for key in KEYS if key in _leader_cache}
+
+    deadline = time.perf_counter() + timeout
+    delay = 0.02
+    while True:
+        follower_records = fetch_records(FOLLOWER_URLS)
+        caught_up = all(
+            key in records and records[key][1] >= version
+            for records in follower_records.values()
+            for key, (_, version) in leader_records.items()
+        )
+        if caught_up or time.perf_counter() >= deadline:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+    if len(leader_records) == len(KEYS) and all(
+        records == leader_records for records in follower_records.values()
+    ):
+        print("All replicas are consistent with the leader (value + version).")
+        return
+
+    # Writes are last-writer-wins on version, so a key is consistent exactly
+    # when every node holds the same record: one set per key decides it, and
+    # only the keys that fail are compared node by node for the report
+    nodes = [leader_records] + list(follower_records.values())
+    inconsistent_keys = [
+        key
+        for key in KEYS
+        if key not in leader_records or len({records.get(key) for records in nodes}) > 1
+    ]
 
     mismatches = []
 
-    for key in KEYS:
-        try:
-            leader_rec = get_record(LEADER_URL, key)
-        except KeyError:
+    for key in inconsistent_keys:
+        leader_rec = leader_records.get(key)
+        if leader_rec is None:
             print(f"Leader is missing key {key}")
             mismatches.append((key, "leader-missing"))
             continue
 
         for follower in FOLLOWER_URLS:
-            try:
-                follower_rec = get_record(follower, key)
-            except KeyError:
+            follower_rec = follower_records[follower].get(key)
+            if follower_rec is None:
                 print(f"{follower} is missing key {key}")
                 mismatches.append((key, f"{follower}-missing"))
                 continue
@@ -120,14 +294,15 @@ def check_data_consistency(label: str = "") -> None:
             if follower_rec != leader_rec:
                 print(
                     f"Mismatch for key {key} on {follower}: "
-                    f"leader={leader_rec}, follower={follower_rec}"
+                    f"leader=(value={leader_rec[0]}, version={leader_rec[1]}), "
+                    f"follower=(value={follower_rec[0]}, version={follower_rec[1]})"
                 )
                 mismatches.append((key, f"{follower}-mismatch"))
 
     if not mismatches:
         print("All replicas are consistent with the leader (value + version).")
     else:
-        print(f"Found {len(mismatches)} inconsistencies.")
+        print(f"Found {len(mismatches)} inconsistencies across {len(inconsistent_keys)} keys.")
 
 
 def main() -> None:
@@ -136,26 +311,44 @@ def main() -> None:
 
     # Warmup health check
     print("Checking cluster health...")
-    print("Leader:", requests.get(f"{LEADER_URL}/health", timeout=5.0).json())
-    for f in FOLLOWER_URLS:
-        print(f"{f}:", requests.get(f"{f}/health", timeout=5.0).json())
+    wait_for_cluster()
+    # fetch every node's health at once, then print them in cluster order
+    nodes = [LEADER_URL] + FOLLOWER_URLS
+    healths = CHECK_EXECUTOR.map(
+        lambda node: orjson.loads(SESSION.get(f"{node}/health", timeout=5.0).content), nodes
+    )
+    for node, health in zip(nodes, healths):
+        print("Leader:" if node == LEADER_URL else f"{node}:", health)
 
     for q in quorums:
-        avg = run_experiment_for_quorum(q)
+        avg, dirty = run_experiment_for_quorum(q)
         avg_latencies.append(avg)
 
-        check_data_consistency(label=f"after write_quorum={q}")
+        check_data_consistency(label=f"after write_quorum={q}", dirty=dirty)
+
+    # matplotlib is only needed for the final plot, so it is imported here
+    # rather than at startup; without a terminal there is no one to show the
+    # window to, so use the headless Agg backend and just save the file
+    import matplotlib
+
+    interactive = os.isatty(1)
+    if not interactive:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
     # Plot write_quorum vs average latency
-    plt.figure()
-    plt.plot(quorums, avg_latencies, marker="o")
-    plt.xlabel("Write Quorum")
-    plt.ylabel("Average Write Latency (ms)")
-    plt.title("Write Quorum vs Average Latency (semi-synchronous replication)")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig("write_quorum_vs_latency.png")
-    plt.show()
+    fig, ax = plt.subplots()
+    ax.plot(quorums, avg_latencies, marker="o")
+    ax.set(
+        xlabel="Write Quorum",
+        ylabel="Average Write Latency (ms)",
+        title="Write Quorum vs Average Latency (semi-synchronous replication)",
+    )
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig("write_quorum_vs_latency.png")
+    if interactive:
+        plt.show()
 
 
 if __name__ == "__main__":